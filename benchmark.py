@@ -0,0 +1,414 @@
+#!/usr/bin/env python3
+# Benchmarks for the file and archive helpers used by kernel_build.py
+# Generates synthetic trees shaped like the mod/ and headers/ build output and times each helper on them.
+# Results are written as json, pass an older result file with --compare to use this as a regression gate.
+# By default the helpers run with verbose output disabled, kernel_build.py enables it. Use --verbose to measure that.
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import sys
+import tempfile
+from datetime import datetime, timezone
+from time import perf_counter
+
+from functions import *
+from functions import print_question as print_green
+from kernel_build import archive_command
+KERNEL_VERSION = "5.10.0-eupnea-bench"
+# in the order they are run, get_benchmarks returns a function for every name
+BENCHMARK_NAMES = ["cpfile_large", "cpfile_small", "cpdir_headers", "rmdir_mod", "create_tree_mod", "archive_modules",
+                   "archive_headers", "extract_modules"]
+
+# peak rss of a forked child that does nothing, subtracted from the helpers' own peak rss. Set before running benchmarks
+rss_baseline_kb = 0
+
+
+# parse arguments from the cli.
+def process_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-o", "--output", dest="output", default="benchmark-results.json",
+                        help="Path to write the json results to")
+    parser.add_argument("-c", "--compare", dest="compare", default=None,
+                        help="Previous json results to compare against. Exits with 1 if a benchmark regressed")
+    parser.add_argument("-t", "--threshold", dest="threshold", type=float, default=10.0,
+                        help="Allowed slowdown of the min time in percent when using --compare. Default: 10")
+    parser.add_argument("-f", "--floor", dest="floor", type=float, default=5.0,
+                        help="Ignore slowdowns smaller than this many milliseconds when using --compare. Default: 5")
+    parser.add_argument("-r", "--repeats", dest="repeats", type=int, default=5,
+                        help="How many times each benchmark is timed. Default: 5")
+    parser.add_argument("-s", "--scale", dest="scale", type=float, default=1.0,
+                        help="Multiplier for the amount of files in the synthetic trees. Default: 1.0")
+    parser.add_argument("--seed", dest="seed", type=int, default=1337,
+                        help="Seed for the synthetic tree generator. Same seed -> same trees")
+    parser.add_argument("-w", "--workdir", dest="workdir", default=None,
+                        help="Directory to create the synthetic trees in. Defaults to a temporary directory")
+    parser.add_argument("-v", "--verbose", dest="verbose", action="store_true", default=False,
+                        help="Enable verbose output in functions.py like kernel_build.py does. Measures the build's "
+                             "code path, including printing every copied file and the tar -v output")
+    parser.add_argument("-b", "--bench", dest="bench", action="append", default=None, choices=BENCHMARK_NAMES,
+                        help="Only run the named benchmark. Can be passed multiple times")
+    args = parser.parse_args()
+    if args.repeats < 1:
+        parser.error("--repeats must be at least 1")
+    return args
+
+
+#######################################################################################
+#                               SYNTHETIC TREE GENERATION                             #
+#######################################################################################
+
+# pseudo C header content, compresses roughly like real kernel headers
+def _header_text(rng: random.Random, size: int) -> bytes:
+    lines = []
+    length = 0
+    while length < size:
+        name = "".join(rng.choices("abcdefghijklmnopqrstuvwxyz_", k=rng.randint(6, 24)))
+        line = rng.choice([f"#define {name.upper()} 0x{rng.getrandbits(32):08x}\n",
+                           f"extern int {name}(struct {name}_data *data, unsigned long flags);\n",
+                           f"struct {name} {{\n\tu32 {name}_id;\n\tvoid *priv;\n}};\n",
+                           f"/* {name} {name} {name} */\n"])
+        lines.append(line)
+        length += len(line)
+    return "".join(lines).encode()[:size]
+
+
+# binary content for modules and blobs, stripped .ko files barely compress
+def _blob(rng: random.Random, size: int) -> bytes:
+    # mix random and zeroed chunks so xz has something to do
+    chunks = []
+    length = 0
+    while length < size:
+        chunk_size = min(rng.randint(512, 8192), size - length)
+        chunks.append(rng.randbytes(chunk_size) if rng.random() < 0.7 else bytes(chunk_size))
+        length += chunk_size
+    return b"".join(chunks)
+
+
+def _write_file(path: str, content: bytes) -> None:
+    mkdir(os.path.dirname(path), create_parents=True)
+    with open(path, "wb") as file:
+        file.write(content)
+
+
+# lib/modules/<version>/kernel/<subsystem>/.../*.ko + the modules.* index files at the top
+def create_mod_tree(root: str, rng: random.Random, scale: float) -> None:
+    modules_dir = f"{root}/lib/modules/{KERNEL_VERSION}"
+    subsystems = ["drivers", "net", "fs", "sound", "crypto", "lib", "arch/x86"]
+    for subsystem in subsystems:
+        for dir_index in range(max(1, int(12 * scale))):
+            # deep nesting like drivers/net/wireless/intel/iwlwifi/mvm
+            depth = rng.randint(1, 5)
+            sub_path = "/".join(f"{subsystem.split('/')[-1]}{dir_index}_{level}" for level in range(depth))
+            for file_index in range(rng.randint(2, 12)):
+                _write_file(f"{modules_dir}/kernel/{subsystem}/{sub_path}/mod{file_index}.ko",
+                            _blob(rng, rng.randint(4 * 1024, 96 * 1024)))
+    for index_file in ["modules.alias", "modules.dep", "modules.symbols", "modules.order", "modules.builtin"]:
+        _write_file(f"{modules_dir}/{index_file}", _header_text(rng, rng.randint(64 * 1024, 512 * 1024)))
+
+
+# include/, arch/x86/include/, scripts/ with lots of small headers + a few large blobs
+def create_headers_tree(root: str, rng: random.Random, scale: float) -> None:
+    for include_dir in ["include", "arch/x86/include"]:
+        for dir_index in range(max(1, int(40 * scale))):
+            depth = rng.randint(1, 4)
+            sub_path = "/".join(f"dir{dir_index}_{level}" for level in range(depth))
+            for file_index in range(rng.randint(5, 30)):
+                _write_file(f"{root}/{include_dir}/{sub_path}/header{file_index}.h",
+                            _header_text(rng, rng.randint(256, 16 * 1024)))
+    for file_index in range(max(1, int(60 * scale))):
+        _write_file(f"{root}/scripts/mod/script{file_index}.c", _header_text(rng, rng.randint(1024, 32 * 1024)))
+    # Large blobs like System.map, Module.symvers and objtool
+    _write_file(f"{root}/System.map", _header_text(rng, 4 * 1024 * 1024))
+    _write_file(f"{root}/Module.symvers", _header_text(rng, 1024 * 1024))
+    _write_file(f"{root}/tools/objtool/objtool", _blob(rng, 2 * 1024 * 1024))
+
+
+# returns (amount of files, total size in bytes)
+def tree_stats(root: str) -> tuple:
+    files = 0
+    size = 0
+    for dir_path, _, file_names in os.walk(root):
+        for file_name in file_names:
+            files += 1
+            size += os.path.getsize(os.path.join(dir_path, file_name))
+    return files, size
+
+
+#######################################################################################
+#                                    MEASUREMENT                                      #
+#######################################################################################
+
+# Run func in a forked child, so that previous runs don't leak into the peak rss. The time and rss are measured inside
+# the child to exclude fork. The child starts with the harness's resident memory, see rss_baseline_kb.
+# Returns (seconds, peak rss of the child in kb, peak rss of the largest tar/xz/cp process it spawned in kb)
+def measure(func) -> tuple:
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:  # child
+        os.close(read_fd)
+        exit_code = 0
+        try:
+            start = perf_counter()
+            func()
+            duration = perf_counter() - start
+            self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+            os.write(write_fd, f"{duration!r} {self_rss} {children_rss}".encode())
+        except BaseException as e:
+            print_error(f"Benchmark run failed: {e!r}")
+            exit_code = 1
+        finally:
+            os.close(write_fd)
+            os._exit(exit_code)
+
+    os.close(write_fd)
+    with os.fdopen(read_fd, "rb") as pipe:
+        measurements = pipe.read()
+    _, status = os.waitpid(pid, 0)
+    if os.waitstatus_to_exitcode(status) != 0 or not measurements:
+        raise RuntimeError("Benchmark run failed")
+    duration, self_rss, children_rss = measurements.split()
+    return float(duration), int(self_rss), int(children_rss)
+
+
+# setup is run before every repeat and is not timed, run is timed
+# processed_bytes is 0 for helpers that don't read file contents, they get no throughput_mb_s
+def run_benchmark(name: str, setup, run, processed_bytes: int, processed_files: int, repeats: int) -> dict:
+    times = []
+    peak_rss = []
+    peak_child_rss = []
+    for _ in range(repeats):
+        setup()
+        duration, self_rss, children_rss = measure(run)
+        times.append(duration)
+        peak_rss.append(self_rss)
+        peak_child_rss.append(children_rss)
+    median = statistics.median(times)
+    result = {
+        "name": name,
+        "files": processed_files,
+        "bytes": processed_bytes,
+        "repeats": repeats,
+        "times": times,
+        "min": min(times),
+        "median": median,
+        "mean": statistics.mean(times),
+        "stdev": statistics.stdev(times) if repeats > 1 else 0.0,
+        "throughput_mb_s": processed_bytes / 1048576 / median if processed_bytes and median else None,
+        "files_per_s": processed_files / median if median else 0.0,
+        # only the memory used by the python helper on top of the forked harness
+        "peak_rss_kb": max(0, max(peak_rss) - rss_baseline_kb),
+        # largest spawned process, raw value. Linux accounts the memory of the spawning python child before exec to
+        # the new process, so this can't drop below about rss_baseline_kb
+        "peak_child_rss_kb": max(peak_child_rss),
+    }
+    if result["throughput_mb_s"] is None:
+        speed = f"{result['files_per_s']:.0f} files/s"
+    else:
+        speed = f"{result['throughput_mb_s']:.1f} MB/s"
+    print_status(f"{name}: median {median:.4f}s, {speed}, "
+                 f"peak rss {result['peak_rss_kb'] / 1024:.1f} MB, "
+                 f"peak subprocess rss {result['peak_child_rss_kb'] / 1024:.1f} MB")
+    return result
+
+
+#######################################################################################
+#                                    BENCHMARKS                                       #
+#######################################################################################
+
+def _reset_dir(path: str) -> None:
+    # rmdir from functions.py is one of the benchmarked functions, don't use it for housekeeping
+    if path_exists(path):
+        bash(f"rm -rf {path}")
+    mkdir(path, create_parents=True)
+
+
+def _noop() -> None:
+    pass
+
+
+# returns a dict of benchmark name -> function(repeats) -> result
+def get_benchmarks(workdir: str) -> dict:
+    mod_src = f"{workdir}/src/mod"
+    headers_src = f"{workdir}/src/headers"
+    scratch = f"{workdir}/scratch"
+    modules_archive = f"{workdir}/modules.tar.xz"
+    headers_archive = f"{workdir}/headers.tar.xz"
+
+    mod_files, mod_bytes = tree_stats(mod_src)
+    headers_files, headers_bytes = tree_stats(headers_src)
+    small_headers = []
+    for dir_path, _, file_names in os.walk(f"{headers_src}/include"):
+        small_headers.extend(os.path.join(dir_path, file_name) for file_name in file_names)
+    small_headers.sort()
+    small_headers_bytes = sum(os.path.getsize(header) for header in small_headers)
+
+    def cpfile_large(repeats: int) -> dict:
+        blob = f"{headers_src}/System.map"
+        return run_benchmark("cpfile_large", lambda: _reset_dir(scratch),
+                             lambda: cpfile(blob, f"{scratch}/System.map"),
+                             os.path.getsize(blob), 1, repeats)
+
+    # the build_headers loops copy headers one by one
+    def cpfile_small(repeats: int) -> dict:
+        def run() -> None:
+            for index, header in enumerate(small_headers):
+                cpfile(header, f"{scratch}/{index}.h")
+
+        return run_benchmark("cpfile_small", lambda: _reset_dir(scratch), run, small_headers_bytes,
+                             len(small_headers), repeats)
+
+    def cpdir_headers(repeats: int) -> dict:
+        return run_benchmark("cpdir_headers", lambda: _reset_dir(scratch),
+                             lambda: cpdir(headers_src, f"{scratch}/headers"),
+                             headers_bytes, headers_files, repeats)
+
+    def rmdir_mod(repeats: int) -> dict:
+        def setup() -> None:
+            _reset_dir(scratch)
+            bash(f"cp -rp {mod_src} {scratch}/mod")
+
+        # only unlinks, the file contents are never read
+        return run_benchmark("rmdir_mod", setup, lambda: rmdir(f"{scratch}/mod", keep_dir=False), 0, mod_files,
+                             repeats)
+
+    def create_tree_mod(repeats: int) -> dict:
+        # only walks the tree, the file contents are never read
+        return run_benchmark("create_tree_mod", _noop, lambda: create_tree(mod_src), 0, mod_files, repeats)
+
+    # same as the "Compressing kernel modules" step in kernel_build.py
+    def archive_modules(repeats: int) -> dict:
+        def run() -> None:
+            os.chdir(f"{mod_src}/lib/modules")
+            bash(f"{archive_command} {modules_archive} ./")
+
+        return run_benchmark("archive_modules", lambda: rmfile(modules_archive), run, mod_bytes, mod_files,
+                             repeats)
+
+    # same as the headers archival step in kernel_build.py
+    def archive_headers(repeats: int) -> dict:
+        def run() -> None:
+            os.chdir(os.path.dirname(headers_src))
+            bash(f"{archive_command} {headers_archive} ./{os.path.basename(headers_src)}/")
+
+        return run_benchmark("archive_headers", lambda: rmfile(headers_archive), run, headers_bytes,
+                             headers_files, repeats)
+
+    def extract_modules(repeats: int) -> dict:
+        def setup() -> None:
+            if not path_exists(modules_archive):
+                bash(f"cd {mod_src}/lib/modules && {archive_command} {modules_archive} ./")
+            _reset_dir(scratch)
+
+        return run_benchmark("extract_modules", setup, lambda: extract_file(modules_archive, scratch),
+                             mod_bytes, mod_files, repeats)
+
+    return {
+        "cpfile_large": cpfile_large,
+        "cpfile_small": cpfile_small,
+        "cpdir_headers": cpdir_headers,
+        "rmdir_mod": rmdir_mod,
+        "create_tree_mod": create_tree_mod,
+        "archive_modules": archive_modules,
+        "archive_headers": archive_headers,
+        "extract_modules": extract_modules,
+    }
+
+
+#######################################################################################
+#                                    RESULTS                                          #
+#######################################################################################
+
+# returns True if no benchmark regressed more than threshold percent and floor milliseconds
+# The min time is compared, as it is the least affected by scheduler noise
+def compare_results(old_results: dict, new_results: dict, threshold: float, floor: float) -> bool:
+    # verbose output changes the measured code path
+    if old_results.get("verbose", False) != new_results["verbose"]:
+        print_error("Previous results were measured with a different --verbose setting")
+        return False
+    old_benchmarks = {result["name"]: result for result in old_results["results"]}
+    passed = True
+    for result in new_results["results"]:
+        old = old_benchmarks.get(result["name"])
+        if old is None:
+            print_warning(f"{result['name']}: not in previous results, skipping")
+            continue
+        # times from differently sized trees can't be compared
+        if old["bytes"] != result["bytes"] or old["files"] != result["files"]:
+            print_error(f"{result['name']}: synthetic tree differs from previous run (different seed/scale?)")
+            passed = False
+            continue
+        difference = result["min"] - old["min"]
+        if old["min"] > 0:
+            change = difference / old["min"] * 100
+        else:
+            change = float("inf") if difference > 0 else 0.0
+        message = f"{result['name']}: {old['min']:.4f}s -> {result['min']:.4f}s ({change:+.1f}%)"
+        if change > threshold and difference * 1000 > floor:
+            print_error(message)
+            passed = False
+        else:
+            print_green(message)
+    return passed
+
+
+if __name__ == "__main__":
+    script_start = perf_counter()
+    args = process_args()
+    # pv writes progress to the terminal and is not used in ci, benchmark the non-interactive path for stable times
+    disable_download_progress()
+    set_verbose(args.verbose)
+
+    output_path = get_full_path(args.output)
+    # load the previous results before anything is written, --output would overwrite them otherwise
+    previous_results = None
+    if args.compare:
+        if get_full_path(args.compare) == output_path:
+            print_error("--compare and --output point to the same file, the previous results would be overwritten")
+            exit(1)
+        with open(args.compare, "r") as file:
+            previous_results = json.load(file)
+
+    benchmarks_workdir = tempfile.mkdtemp(prefix="eupnea-bench-", dir=args.workdir)
+    try:
+        print_status(f"Generating synthetic trees in {benchmarks_workdir}")
+        # generate in a child, so the already resident but freed generator memory doesn't hide helper allocations
+        def generate_trees() -> None:
+            generator = random.Random(args.seed)
+            create_mod_tree(f"{benchmarks_workdir}/src/mod", generator, args.scale)
+            create_headers_tree(f"{benchmarks_workdir}/src/headers", generator, args.scale)
+
+        measure(generate_trees)
+
+        benchmarks = get_benchmarks(benchmarks_workdir)
+        selected = args.bench or BENCHMARK_NAMES
+        rss_baseline_kb = measure(_noop)[1]
+
+        results = {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "rss_baseline_kb": rss_baseline_kb,
+            "seed": args.seed,
+            "scale": args.scale,
+            "verbose": args.verbose,
+            "mod_tree": dict(zip(["files", "bytes"], tree_stats(f"{benchmarks_workdir}/src/mod"))),
+            "headers_tree": dict(zip(["files", "bytes"], tree_stats(f"{benchmarks_workdir}/src/headers"))),
+            "results": [benchmarks[bench_name](args.repeats) for bench_name in selected],
+        }
+    finally:
+        bash(f"rm -rf {benchmarks_workdir}")
+
+    with open(output_path, "w") as file:
+        json.dump(results, file, indent=2)
+    print_header(f"Results written to {output_path} in: " + "%.0f" % (perf_counter() - script_start) + " seconds")
+
+    if previous_results is not None:
+        if not compare_results(previous_results, results, args.threshold, args.floor):
+            print_error(f"Benchmarks regressed by more than {args.threshold}% and {args.floor}ms")
+            sys.exit(1)
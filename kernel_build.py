@@ -10,6 +10,8 @@ from functions import *
 from functions import print_question as print_green
 
 branch_name = "release-R112-15359.B-chromeos-5.10"
+# fast multicore xtreme compression, used for the modules and headers archives. Also benchmarked by benchmark.py
+archive_command = "tar -cv -I 'xz -9 -T0' -f"
 
 
 # parse arguments from the cli.
@@ -74,7 +76,7 @@ def build_modules() -> None:
     os.chdir("./mod/lib/modules")
     modules_start = perf_counter()
     try:
-        bash("tar -cv -I 'xz -9 -T0' -f ../../../modules.tar.xz ./")  # fast multicore xtreme compression
+        bash(f"{archive_command} ../../../modules.tar.xz ./")
     except subprocess.CalledProcessError:
         print_error("Modules archival failed in: " + "%.0f" % (perf_counter() - modules_start) + " seconds")
         exit(1)
@@ -188,8 +190,7 @@ def build_headers():
     rmdir(f"./linux-headers-{kernel_version}/headers", keep_dir=False)
 
     try:
-        # fast multicore xtreme compression
-        bash(f"tar -cv -I 'xz -9 -T0' -f ./headers.tar.xz ./linux-headers-{kernel_version}/")
+        bash(f"{archive_command} ./headers.tar.xz ./linux-headers-{kernel_version}/")
     except subprocess.CalledProcessError:
         print_error("Headers archival failed in: " + "%.0f" % (perf_counter() - headers_start) + " seconds")
         exit(1)